@@ -7,7 +7,8 @@ This module contains two classes:
 1. CorpusReader
     This class contains all relevant data structures and methods needed to read an online corpus
     from a given URL, and prepare it for the statistical counts.
-    It has a constructor which receives a URL indicating the location of the online corpus.
+    It has a constructor which receives a URL indicating the location of the online corpus
+    (and optionally the directory to cache the filtered corpus in).
     The constructor filters only specific characters. It also changes every letter to lowercase.
 2. LanguageModel
     This class contains all relevant data structures and methods needed to perform statistical
@@ -16,38 +17,249 @@ This module contains two classes:
     instance of the CorpusReader class), and:
     * gathers unigram and bigram raw count
     * obtains MLE unigram and bigram probabilities and applies Laplace smoothing.
-    * The probabilities are saved as instance variables
+    * The probabilities are saved as instance variables (mle_unigram, mle_bigram): read-only
+      dict-like views over dense log2 probability tables
 """
+import hashlib
+import math
+import os
 import string
-import urllib  # TODO: use this in the constructor of CorpusReader
+import tempfile
+import urllib.request
+from collections.abc import Iterable, Iterator, Mapping
+from itertools import islice
+from typing import Optional
 
-KNOWN_CHARACTERS = tuple(string.ascii_lowercase.split("") + [",", ".", ":", "\n", "#", "(", ")", "!", "?", "'", '"'])
+KNOWN_CHARACTERS = tuple(string.ascii_lowercase) + (" ", ",", ".", ":", "\n", "#", "(", ")", "!", "?", "'", '"')
+VOCABULARY_SIZE = len(KNOWN_CHARACTERS)
+CHAR_TO_INDEX = {c: i for i, c in enumerate(KNOWN_CHARACTERS)}
+# byte of a known character <-> its index in KNOWN_CHARACTERS; any other byte -> _UNKNOWN_INDEX
+_UNKNOWN_INDEX = 255
+_INDEX_TABLE = bytes(CHAR_TO_INDEX.get(chr(b), _UNKNOWN_INDEX) for b in range(256))
+_CHAR_TABLE = bytes.maketrans(bytes(range(VOCABULARY_SIZE)), "".join(KNOWN_CHARACTERS).encode())
+# byte -> lowercase byte
+_LOWER_TABLE = bytes.maketrans(string.ascii_uppercase.encode(), string.ascii_lowercase.encode())
+# (alphabet, to_lower) -> bytes to delete, built once per alphabet
+_DELETE_TABLES: dict[tuple[tuple[str, ...], bool], bytes] = {}
+_CHUNK_SIZE = 64 * 1024
+# filtered corpora of previous runs, one file per url (by default next to this module, which is
+# skipped if that directory is not writable)
+_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+
+def encode(text: str) -> bytes:
+    """
+    Returns the text (made of KNOWN_CHARACTERS only) as one byte per character, holding the
+    character's index in KNOWN_CHARACTERS, so that decode(encode(text)) == text.
+    Raises ValueError if the text has any other character.
+    """
+    try:
+        indices = text.encode('ascii').translate(_INDEX_TABLE)
+    except UnicodeEncodeError as e:
+        raise ValueError(f'unknown character {text[e.start]!r} at position {e.start}') from None
+    position = indices.find(_UNKNOWN_INDEX)
+    if position != -1:
+        raise ValueError(f'unknown character {text[position]!r} at position {position}')
+    return indices
+
+
+def decode(indices: bytes) -> str:
+    """
+    The inverse of encode.
+    """
+    return indices.translate(_CHAR_TABLE).decode('ascii')
+
+
+def _get_delete_table(alphabet: tuple[str, ...], to_lower: bool) -> bytes:
+    key = (tuple(alphabet), to_lower)
+    if key not in _DELETE_TABLES:
+        allowed = frozenset(alphabet)
+        _DELETE_TABLES[key] = bytes(b for b in range(256)
+                                    if (chr(b).lower() if to_lower else chr(b)) not in allowed)
+    return _DELETE_TABLES[key]
+
+
+def _bigram_index(w2: str, w1: str) -> Optional[int]:
+    """
+    Returns the index of the bigram (w1, w2) in a flat bigram table, or None if either character is unknown.
+    """
+    i1, i2 = CHAR_TO_INDEX.get(w1), CHAR_TO_INDEX.get(w2)
+    return None if i1 is None or i2 is None else i1 * VOCABULARY_SIZE + i2
+
+
+# the default alphabet is the one every reader filters with, so its tables are ready at import time
+_get_delete_table(KNOWN_CHARACTERS, True)
+_get_delete_table(KNOWN_CHARACTERS, False)
 
 
 class CorpusReader:
-    def __init__(self, url: str):
-        unfiltered_content = self._get_content(url)
-        self._message = self._filter(unfiltered_content)
+    def __init__(self, url: str, cache_dir: str = _CACHE_DIR):
+        """
+        cache_dir is where the filtered corpus is cached between runs; the corpus is still read
+        if the cache cannot be written there.
+        """
+        cache_path = self._get_cache_path(url, cache_dir)
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as cache_file:
+                self._message = cache_file.read().decode('ascii')
+        else:
+            unfiltered_content = self._get_content(url)
+            self._message = self._filter(unfiltered_content)
+            self._write_cache(cache_path)
+
+    def get_corpus(self) -> str:
+        return self._message
+
+    @staticmethod
+    def _get_cache_path(url: str, cache_dir: str) -> str:
+        # the alphabet is part of the key, so changing it never reads a stale corpus
+        key = hashlib.sha1("\0".join((url,) + KNOWN_CHARACTERS).encode()).hexdigest()
+        return os.path.join(cache_dir, f'{key}.bin')
+
+    def _write_cache(self, cache_path: str):
+        """
+        Writes the filtered corpus to a temporary file and renames it, so an interrupted run
+        never leaves a partial cache file behind.
+        The cache is only an optimisation: if it cannot be written, the corpus is simply not cached.
+        """
+        cache_dir = os.path.dirname(cache_path)
+        tmp_name = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=cache_dir, delete=False) as tmp_file:
+                tmp_name = tmp_file.name
+                tmp_file.write(self._message.encode('ascii'))
+            os.replace(tmp_name, cache_path)
+        except OSError:
+            if tmp_name is not None and os.path.exists(tmp_name):
+                os.remove(tmp_name)
 
-    def _get_content(self, url: str) -> str:
-        raise NotImplementedError()
+    def _get_content(self, url: str) -> Iterator[bytes]:
+        """
+        Yields the content of the url in chunks, as they are downloaded.
+        """
+        with urllib.request.urlopen(url) as response:
+            yield from iter(lambda: response.read(_CHUNK_SIZE), b'')
 
-    def _filter(self, message: str, alphabet: list[str] = KNOWN_CHARACTERS, to_lower: bool = True) -> str:
-        raise NotImplementedError()
+    def _filter(self, chunks: Iterable[bytes], alphabet: tuple[str, ...] = KNOWN_CHARACTERS,
+                to_lower: bool = True) -> str:
+        """
+        Keeps only the characters of the message whose (lowercased) character is in the alphabet.
+        Each chunk is filtered as soon as it arrives, with a single bytes.translate call.
+        The alphabet must be ASCII, as the filtered corpus is (see encode).
+        """
+        if not "".join(alphabet).isascii():
+            raise ValueError(f'the alphabet must be ASCII, got {alphabet!r}')
+        table = _LOWER_TABLE if to_lower else None
+        delete = _get_delete_table(alphabet, to_lower)
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk.translate(table, delete=delete)
+        return buffer.decode('ascii')
+
+
+class _MLEView(Mapping):
+    """
+    A read-only mapping from a character (or a (w2, w1) pair of characters) to its log2 probability,
+    reading straight from a dense table of the language model, so no per-key dict is ever built.
+    """
+
+    def __init__(self, table: list[float], is_bigram: bool):
+        self._table = table
+        self._is_bigram = is_bigram
+
+    def _index(self, key) -> Optional[int]:
+        if not self._is_bigram:
+            return CHAR_TO_INDEX.get(key)
+        w2, w1 = key
+        return _bigram_index(w2, w1)
+
+    def __getitem__(self, key) -> float:
+        i = self._index(key)
+        if i is None:
+            raise KeyError(key)
+        return self._table[i]
+
+    def get(self, key, default=None):
+        i = self._index(key)
+        return default if i is None else self._table[i]
+
+    def __iter__(self):
+        if not self._is_bigram:
+            return iter(KNOWN_CHARACTERS)
+        return ((w2, w1) for w1 in KNOWN_CHARACTERS for w2 in KNOWN_CHARACTERS)
+
+    def __len__(self) -> int:
+        return len(self._table)
 
 
 class LanguageModel:
     def __init__(self, corpus_reader: CorpusReader):
-        _corpus_reader = corpus_reader
+        # only the encoded corpus is kept, all counting is done over integers
+        self._corpus_idx = encode(corpus_reader.get_corpus())
+        self._unigram_counts, self._bigram_counts = self._gather_raw_counts()
+        self._obtain_probabilities()
 
-    def _gather_unigram_raw_count(self):
-        raise NotImplementedError()
+    def get_mle_unigram(self, w: str) -> float:
+        """
+        Returns log2 of the Laplace smoothed probability P(w).
+        """
+        return self.mle_unigram.get(w, self._unseen_log_prob)
 
-    def _gather_bigram_raw_count(self):
-        raise NotImplementedError()
+    def get_mle_bigram(self, w2: str, w1: str) -> float:
+        """
+        Returns log2 of the Laplace smoothed probability P(w2|w1).
+        """
+        i = _bigram_index(w2, w1)
+        return self._unseen_log_prob if i is None else self._log_bigram[i]
 
-    def _obtain_probabilities(self):
-        raise NotImplementedError()
+    def to_matrices(self) -> tuple[list[float], list[float]]:
+        """
+        Returns copies of the log2 probability tables: the unigram one by symbol index, and the bigram one
+        flattened so that log2 P(w2|w1) is at w1 * VOCABULARY_SIZE + w2.
+        """
+        return self._log_unigram.copy(), self._log_bigram.copy()
+
+    def get_unigram_counts(self) -> dict[str, int]:
+        return dict(zip(KNOWN_CHARACTERS, self._unigram_counts))
 
-    def _apply_laplace(self):
-        raise NotImplementedError()
+    def get_bigram_counts(self) -> dict[tuple[str, str], int]:
+        return {(KNOWN_CHARACTERS[i % VOCABULARY_SIZE], KNOWN_CHARACTERS[i // VOCABULARY_SIZE]): count
+                for i, count in enumerate(self._bigram_counts) if count}
+
+    def _gather_raw_counts(self) -> tuple[list[int], list[int]]:
+        """
+        Walks the corpus once and returns two dense tables:
+            unigram counts - the count of KNOWN_CHARACTERS[i] is at index i.
+            bigram counts - the count of w2 following w1 is at index w1 * VOCABULARY_SIZE + w2
+                            (w1, w2 being indices in KNOWN_CHARACTERS).
+        Every character except the last one precedes exactly one bigram, so the unigram counts
+        are the row sums of the bigram table, plus the last character.
+        """
+        v = VOCABULARY_SIZE
+        bigram_counts = [0] * (v * v)
+        for w1, w2 in zip(self._corpus_idx, islice(self._corpus_idx, 1, None)):
+            bigram_counts[w1 * v + w2] += 1
+        unigram_counts = [sum(bigram_counts[w1 * v:(w1 + 1) * v]) for w1 in range(v)]
+        if self._corpus_idx:
+            unigram_counts[self._corpus_idx[-1]] += 1
+        return unigram_counts, bigram_counts
+
+    def _obtain_probabilities(self):
+        """
+        Fills dense log2 probability tables (laid out like the count tables), with Laplace (add 1)
+        smoothing applied directly on the raw counts:
+            P(w) = (count(w) + 1) / (N + V)
+            P(w2|w1) = (count(w1, w2) + 1) / (count(w1) + V)
+        """
+        v = VOCABULARY_SIZE
+        # log2 of every denominator, computed once, so each entry is a subtraction of two logs
+        log_unigram_den = math.log2(len(self._corpus_idx) + v)
+        log_bigram_den = [math.log2(count + v) for count in self._unigram_counts]
+        self._log_unigram = [math.log2(count + 1) - log_unigram_den for count in self._unigram_counts]
+        self._log_bigram = [math.log2(count + 1) - log_bigram_den[i // v]
+                            for i, count in enumerate(self._bigram_counts)]
+        # characters outside the alphabet were never seen in the corpus
+        self._unseen_log_prob = -log_unigram_den
+        self.mle_unigram = _MLEView(self._log_unigram, is_bigram=False)
+        self.mle_bigram = _MLEView(self._log_bigram, is_bigram=True)
@@ -15,27 +15,42 @@ The main function does the following logic:
         • The initial temperature, threshold and cooling rate used.
         • The content of the deciphered message.
 """
+import os
+
 import language_model
 import permutation
 import simulated_annealing
 
 URL = 'http://www.gutenberg.org/files/76/76-0.txt'
+ENCRYPTED_MESSAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'problemset_07_encrypted_input.txt')
+INITIAL_TEMPERATURE = 10
+THRESHOLD = 10 ** -1
+COOLING_RATE = 0.95
 
 
 def main():
-    raise NotImplementedError()
-
     # 1. read the corpus
+    corpus = language_model.CorpusReader(URL)
 
     # 2. create a language model
+    lang_model = language_model.LanguageModel(corpus)
 
     # 3. read the encrypted message
+    with open(ENCRYPTED_MESSAGE_PATH) as enc_file:
+        enc_message = enc_file.read()
 
     # 4. create initial hypothesis
+    initial_perm = permutation.Permutation()
 
     # 5. run simulated annealing
+    annealing = simulated_annealing.SimulatedAnnealing(INITIAL_TEMPERATURE, THRESHOLD, COOLING_RATE)
+    winning_perm = annealing.run(initial_perm, enc_message, lang_model)
 
     # 6. print results
+    print(f'Winning permutation: {dict(winning_perm.perm)}')
+    print(f'Initial temperature: {INITIAL_TEMPERATURE}, threshold: {THRESHOLD}, cooling rate: {COOLING_RATE}')
+    print('Deciphered message:')
+    print(winning_perm.translate(enc_message))
 
 
 if __name__ == '__main__':
@@ -6,11 +6,14 @@ Classes:
 
 1. Permutation:
     1) Constructor:
-        The constructor receives some mapping between the characters # TODO: how to map?
+        The constructor receives a dict mapping every character of Σ to its image
+        (by default, the identity permutation). The permutation keeps its own copy of it,
+        exposed read-only as perm.
+        A permutation made by get_neighbor also remembers the two characters it swapped.
     2)  get_neighbor:
          returns a random neighbor of the current permutation instance.
          A neighbor of a permutation is defined as a new permutation that
-         replaces the mapping of two randomly chosen characters from Σ.
+         replaces the mapping of two randomly chosen (distinct) characters from Σ.
     3)  translate:
         receives an input string, and returns the translation of that string according to the
         current permutation instance (i.e. takes each character of the string and replaces it
@@ -21,20 +24,109 @@ Classes:
         Note: energy = the result of translating the encrypted message according
         to the permutation key, and evaluating the probability of this translated sequence
         of characters according to the language model.
+        The message must consist of characters of Σ only (a ValueError is raised otherwise); it is
+        translated and scored in a single pass over the language model's dense log probability tables.
+        The energy is cached on the instance, so it can also be derived incrementally
+        from a neighbour's energy (see simulated_annealing).
+    5) get_index_lut:
+        returns the permutation over symbol indices (see language_model.encode), which
+        simulated annealing uses to work on integers rather than characters.
 """
-from random import choice  # TODO: use in get_neighbor to get the thing
-from language_model import KNOWN_CHARACTERS, LanguageModel
+from collections.abc import Mapping
+from itertools import islice
+from random import Random, sample
+from types import MappingProxyType
+from typing import Optional
+
+from language_model import CHAR_TO_INDEX, KNOWN_CHARACTERS, VOCABULARY_SIZE, LanguageModel, encode
+
+
+# read-only, so no instance can ever alter the default of all the others
+_IDENTITY: Mapping[str, str] = MappingProxyType({c: c for c in KNOWN_CHARACTERS})
 
 
 class Permutation:
-    def __init__(self, perm: dict[str, str]):
-        self.perm: dict[str, str] = perm
+    def __init__(self, perm: Optional[Mapping[str, str]] = None, swapped: Optional[tuple[str, str]] = None):
+        # copied and only exposed read-only (see perm), as the caches below are derived from it
+        self._perm: dict[str, str] = dict(_IDENTITY if perm is None else perm)
+        # the two characters whose mappings were replaced to get this permutation from its parent
+        self.swapped = swapped
+        # str.translate table, built on the first translation
+        self._table: Optional[dict[int, str]] = None
+        # the permutation over symbol indices, built on first use or derived from the parent's
+        self._lut: Optional[bytearray] = None
+        self._keys: Optional[tuple[str, ...]] = None
+        self._energy: Optional[float] = None
+        self._energy_args: Optional[tuple[str, LanguageModel]] = None
+
+    @property
+    def perm(self) -> Mapping[str, str]:
+        """
+        The mapping of every character to its image, read-only: a permutation never changes,
+        get_neighbor returns a new one.
+        """
+        return MappingProxyType(self._perm)
 
-    def get_neighbor(self) -> 'Permutation':
-        raise NotImplementedError()
+    def get_neighbor(self, rng: Optional[Random] = None) -> 'Permutation':
+        """
+        rng is the random generator to draw with, the random module's one by default.
+        """
+        if self._keys is None:
+            self._keys = tuple(self._perm)
+        # two distinct characters, so a neighbour always differs from its parent
+        key1, key2 = (sample if rng is None else rng.sample)(self._keys, 2)
+        new_perm = self._perm.copy()
+        new_perm[key1], new_perm[key2] = self._perm[key2], self._perm[key1]
+        neighbor = Permutation(new_perm, swapped=(key1, key2))
+        # a neighbour has the same characters as its parent
+        neighbor._keys = self._keys
+        if self._lut is not None:
+            i1, i2 = CHAR_TO_INDEX[key1], CHAR_TO_INDEX[key2]
+            neighbor._lut = lut = self._lut.copy()
+            lut[i1], lut[i2] = lut[i2], lut[i1]
+        return neighbor
+
+    @classmethod
+    def from_index_lut(cls, lut: bytearray) -> 'Permutation':
+        """
+        The inverse of get_index_lut.
+        """
+        permutation = cls({c: KNOWN_CHARACTERS[i] for c, i in zip(KNOWN_CHARACTERS, lut)})
+        permutation._lut = lut
+        return permutation
+
+    def get_index_lut(self) -> bytearray:
+        """
+        Returns a table where entry i is the index of the image of KNOWN_CHARACTERS[i].
+        """
+        if self._lut is None:
+            self._lut = bytearray(CHAR_TO_INDEX[self._perm.get(c, c)] for c in KNOWN_CHARACTERS)
+        return self._lut
 
     def translate(self, string: str) -> str:
-        raise NotImplementedError()
+        if self._table is None:
+            self._table = str.maketrans(self._perm)
+        return string.translate(self._table)
+
+    def get_energy(self, enc_message: str, lang_module: LanguageModel) -> float:
+        """
+        Raises ValueError if enc_message has a character outside Σ, which has no row in the tables.
+        """
+        if self._energy is None or self._energy_args != (enc_message, lang_module):
+            # translating and scoring are one pass over the encoded message, no translated string is built
+            enc_idx = encode(enc_message)
+            unigram, bigram = lang_module.to_matrices()
+            v = VOCABULARY_SIZE
+            lut = self.get_index_lut()
+            energy = -unigram[lut[enc_idx[0]]] if enc_idx else 0.0
+            energy -= sum(bigram[lut[w1] * v + lut[w2]] for w1, w2 in zip(enc_idx, islice(enc_idx, 1, None)))
+            self.set_energy(energy, enc_message, lang_module)
+        return self._energy
 
-    def get_energy(self, enc_message: str, lang_module: LanguageModel):
-        raise NotImplementedError()
+    def set_energy(self, energy: float, enc_message: str, lang_module: LanguageModel):
+        """
+        Caches an energy of this permutation that was computed elsewhere (e.g. incrementally,
+        from the energy of its parent).
+        """
+        self._energy = energy
+        self._energy_args = (enc_message, lang_module)
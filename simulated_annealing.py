@@ -7,7 +7,10 @@ Classes:
 SimulatedAnnealing:
     This class implements the simulated annealing algorithm.
     1) constructor:
-        receives an initial temperature, a threshold and a cooling rate (in that order).
+        receives an initial temperature, a threshold and a cooling rate (in that order),
+        where the threshold must be positive and the cooling rate between 0 and 1 (exclusive),
+        and optionally the number of neighbours to try at every temperature (1 by default)
+        and a seed for the annealer's own random generator.
     2) run:
         receives an initial hypothesis (= initial permutation),
         an encrypted message
@@ -19,5 +22,170 @@ SimulatedAnnealing:
             for a probability p,
                 If r < p: switch to a neighbour hypothesis
                 Else: stay with the current hypothesis
+        A neighbour differs from its parent only in the mappings of two characters, so the
+        energy difference is summed over the distinct bigrams of the message touching those
+        characters alone, each weighted by its count.
+        The loop itself (_anneal) works on integers only: the message is encoded to symbol
+        indices once, the hypothesis is an index table, and the log probabilities are looked up
+        in flat tables; a Permutation is only built for the result.
+    3) run_multi:
+        like run, but receives several initial hypotheses and runs an independent annealing
+        chain from each of them in parallel processes (multi-start simulated annealing),
+        returning the result of lowest energy. Every chain gets its own random generator,
+        seeded from the annealer's one.
 """
-from random import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from math import exp
+from random import Random
+from typing import Optional
+
+from language_model import VOCABULARY_SIZE, LanguageModel, encode
+from permutation import Permutation
+
+
+class SimulatedAnnealing:
+    def __init__(self, init_temp: float, threshold: float, cool_rate: float, moves_per_temp: int = 1,
+                 seed: Optional[int] = None):
+        if not 0 < cool_rate < 1:
+            raise ValueError(f'cool_rate must be between 0 and 1 (exclusive), got {cool_rate}')
+        if threshold <= 0:
+            raise ValueError(f'threshold must be positive, got {threshold}')
+        self._init_temp = init_temp
+        self._cool_rate = cool_rate
+        self._moves_per_temp = moves_per_temp
+        self._num_levels = self._get_num_levels(init_temp, threshold, cool_rate)
+        self._rng = Random(seed)
+        # the kernel of the last (message, language model) annealed, reused by later runs on them
+        self._kernel_args: Optional[tuple[str, LanguageModel]] = None
+        self._kernel: Optional[partial] = None
+
+    def run(self, initial_perm: Permutation, enc_message: str, lang_model: LanguageModel) -> Permutation:
+        anneal = self._get_kernel(enc_message, lang_model)
+        lut, energy = anneal(initial_perm.get_index_lut(), initial_perm.get_energy(enc_message, lang_model),
+                             self._rng)
+        return self._to_permutation(lut, energy, enc_message, lang_model)
+
+    def run_multi(self, initial_perms: list[Permutation], enc_message: str, lang_model: LanguageModel,
+                  n_workers: Optional[int] = None) -> Permutation:
+        """
+        n_workers defaults to the number of CPUs. The lookup tables are sent to every worker once,
+        when it starts (never the language model itself); each task only carries the initial hypothesis.
+        """
+        anneal = self._get_kernel(enc_message, lang_model)
+        luts = [perm.get_index_lut() for perm in initial_perms]
+        energies = [perm.get_energy(enc_message, lang_model) for perm in initial_perms]
+        seeds = [self._rng.getrandbits(64) for _ in initial_perms]
+        with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(anneal,)) as executor:
+            results = list(executor.map(_run_worker_chain, luts, energies, seeds))
+        lut, energy = min(results, key=lambda result: result[1])
+        return self._to_permutation(lut, energy, enc_message, lang_model)
+
+    def _get_kernel(self, enc_message: str, lang_model: LanguageModel):
+        """
+        Returns the annealing loop bound to everything it needs but the initial hypothesis, its energy
+        and the random generator.
+        The message is encoded and indexed only once for any number of runs on it; this raises ValueError
+        if it has a character outside KNOWN_CHARACTERS.
+        """
+        if self._kernel is None or self._kernel_args != (enc_message, lang_model):
+            enc_idx = encode(enc_message)
+            unigram, bigram = lang_model.to_matrices()
+            self._kernel = partial(_anneal, enc_idx, self._get_affected_bigrams(enc_idx), unigram, bigram,
+                                   init_temp=self._init_temp, num_levels=self._num_levels,
+                                   cool_rate=self._cool_rate, moves_per_temp=self._moves_per_temp)
+            self._kernel_args = (enc_message, lang_model)
+        return self._kernel
+
+    @staticmethod
+    def _get_num_levels(init_temp: float, threshold: float, cool_rate: float) -> int:
+        """
+        Returns the number of temperatures the geometric schedule goes through before it reaches the
+        threshold, i.e. the number of iterations of: while t > threshold: t *= cool_rate
+        The loop is run on the temperatures themselves rather than solved in closed form, as the
+        rounding of the repeated products can add a level, e.g. when threshold / init_temp is an
+        exact power of cool_rate.
+        Requires 0 < cool_rate < 1 and threshold > 0.
+        """
+        num_levels = 0
+        t = init_temp
+        while t > threshold:
+            t *= cool_rate
+            num_levels += 1
+        return num_levels
+
+    @staticmethod
+    def _to_permutation(lut: bytearray, energy: float, enc_message: str, lang_model: LanguageModel) -> Permutation:
+        result = Permutation.from_index_lut(lut)
+        result.set_energy(energy, enc_message, lang_model)
+        return result
+
+    @staticmethod
+    def _get_affected_bigrams(enc_idx: bytes) -> list[list[tuple[int, int, int]]]:
+        """
+        Maps every symbol index s to the bigrams of the message that change when the mapping of s does -
+        row s and column s of the message's bigram count matrix - as (w1, w2, count) triplets.
+        """
+        counts = Counter(zip(enc_idx, islice(enc_idx, 1, None)))
+        affected: list[list[tuple[int, int, int]]] = [[] for _ in range(VOCABULARY_SIZE)]
+        for (w1, w2), count in counts.items():
+            affected[w1].append((w1, w2, count))
+            if w2 != w1:
+                affected[w2].append((w1, w2, count))
+        return affected
+
+
+# the kernel a run_multi worker process anneals with, set once when the worker starts
+_worker_kernel: Optional[partial] = None
+
+
+def _init_worker(kernel: partial):
+    global _worker_kernel
+    _worker_kernel = kernel
+
+
+def _run_worker_chain(lut: bytearray, energy: float, seed: int) -> tuple[bytearray, float]:
+    return _worker_kernel(lut, energy, Random(seed))
+
+
+def _anneal(enc_idx: bytes, affected_bigrams: list[list[tuple[int, int, int]]], unigram: list[float],
+            bigram: list[float], lut: bytearray, energy: float, rng: Random, init_temp: float,
+            num_levels: int, cool_rate: float, moves_per_temp: int) -> tuple[bytearray, float]:
+    """
+    The simulated annealing loop, over index tables: starting from the hypothesis lut (of the given energy),
+    returns the final hypothesis and its energy.
+    No table is copied per step: new_lut is kept equal to lut, except for the two mappings swapped to
+    try a neighbour, which are then either applied to lut or undone.
+    """
+    v = VOCABULARY_SIZE
+    random, randrange = rng.random, rng.randrange
+    first = enc_idx[0] if enc_idx else -1
+    lut = lut.copy()
+    new_lut = lut.copy()
+    t = init_temp
+    for _ in range(num_levels):
+        neg_inv_t = -1 / t
+        for _ in range(moves_per_temp):
+            # the neighbour replaces the mappings of the characters at indices i1 != i2
+            i1 = randrange(v)
+            i2 = (i1 + 1 + randrange(v - 1)) % v
+            new_lut[i1], new_lut[i2] = lut[i2], lut[i1]
+            delta = 0.0
+            for w1, w2, count in affected_bigrams[i1]:
+                delta += count * (bigram[lut[w1] * v + lut[w2]] - bigram[new_lut[w1] * v + new_lut[w2]])
+            for w1, w2, count in affected_bigrams[i2]:
+                # bigrams holding both characters were already counted with i1
+                if w1 != i1 and w2 != i1:
+                    delta += count * (bigram[lut[w1] * v + lut[w2]] - bigram[new_lut[w1] * v + new_lut[w2]])
+            if first == i1 or first == i2:
+                delta += unigram[lut[first]] - unigram[new_lut[first]]
+            # p = e^(-delta/t) is at least 1 for a non-positive delta, so r < p needs no draw
+            if delta <= 0 or random() < exp(delta * neg_inv_t):
+                lut[i1], lut[i2] = new_lut[i1], new_lut[i2]
+                energy += delta
+            else:
+                new_lut[i1], new_lut[i2] = lut[i1], lut[i2]
+        t *= cool_rate
+    return lut, energy